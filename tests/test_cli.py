@@ -1,47 +1,138 @@
 import json
-import os
-import subprocess
 import sys
+import threading
 from pathlib import Path
 
-import jsonschema
+import pytest
+from click.testing import CliRunner
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
-SCHEMAS = {
-    "metadata": json.load((REPO_ROOT / "schemas" / "metadata.schema.json").open()),
-    "rollup": json.load((REPO_ROOT / "schemas" / "rollup.schema.json").open()),
-}
+sys.path.insert(0, str(REPO_ROOT / "tools"))
+
+import dk  # noqa: E402
+from dk import DKError, _get_validator, cli, extract_first_json, validate_payload  # noqa: E402
 
 
 def run_cli(args):
-    env = os.environ.copy()
-    env["ANALYZE_BACKEND"] = "stub"
-    cmd = [sys.executable, str(REPO_ROOT / "tools" / "dk.py")] + args
-    return subprocess.run(cmd, capture_output=True, text=True, env=env)
+    runner = CliRunner(mix_stderr=False)
+    return runner.invoke(cli, args, env={"ANALYZE_BACKEND": "stub"})
 
 
 def validate_schema(payload, name):
-    jsonschema.validate(instance=payload, schema=SCHEMAS[name])
+    error = next(_get_validator(name).iter_errors(payload), None)
+    assert error is None, error.message
 
 
 def test_analyze_metadata_stub():
     transcript = REPO_ROOT / "fixtures" / "sample_transcript.txt"
     result = run_cli(["analyze", "--input", str(transcript), "--mode", "metadata"])
-    assert result.returncode == 0, result.stderr
-    payload = json.loads(result.stdout)
+    assert result.exit_code == 0, result.stderr
+    payload = json.loads(result.output)
     validate_schema(payload, "metadata")
 
 
 def test_analyze_rollup_stub():
     transcript = REPO_ROOT / "fixtures" / "sample_transcript.txt"
     result = run_cli(["analyze", "--input", str(transcript), "--mode", "rollup"])
-    assert result.returncode == 0, result.stderr
-    payload = json.loads(result.stdout)
+    assert result.exit_code == 0, result.stderr
+    payload = json.loads(result.output)
     validate_schema(payload, "rollup")
 
 
 def test_invalid_file_errors():
     missing = REPO_ROOT / "fixtures" / "missing.txt"
     result = run_cli(["analyze", "--input", str(missing), "--mode", "metadata"])
-    assert result.returncode != 0
+    assert result.exit_code != 0
     assert result.stderr.strip().startswith("{")
+
+
+def test_invalid_payload_fails_validation():
+    payload = {"summary": 1, "incidents": "none", "next_steps": [], "status": "ok", "extra": True}
+    with pytest.raises(DKError, match="Schema validation failed for rollup"):
+        validate_payload(payload, "rollup")
+
+
+def test_oversized_transcript_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(dk, "MAX_TRANSCRIPT_BYTES", 16)
+    transcript = tmp_path / "long.txt"
+    transcript.write_text("Agent Alex: " + "x" * 32, encoding="utf-8")
+    result = run_cli(["analyze", "--input", str(transcript), "--mode", "metadata"])
+    assert result.exit_code != 0
+    assert json.loads(result.stderr)["code"] == "analysis_error"
+
+
+def test_extract_first_json_handles_braces_in_strings():
+    content = 'Here you go:\n```json\n{"summary": "closing } early {", "status": null}\n```\n{"ignored": true}'
+    assert extract_first_json(content) == {"summary": "closing } early {", "status": None}
+
+
+def test_extract_first_json_rejects_truncated_output():
+    with pytest.raises(DKError, match="Unable to parse JSON object"):
+        extract_first_json('{"summary": "cut off')
+
+
+def test_unknown_schema_errors():
+    with pytest.raises(DKError, match="Unknown schema"):
+        validate_payload({}, "transcript")
+
+
+def test_scan_keywords_matches_overlapping_keywords(monkeypatch):
+    monkeypatch.setattr(dk, "_KEYWORDS", ("config", "config change"))
+    assert dk._scan_keywords("A Config Change landed") == {"config", "config change"}
+
+
+def test_rollup_stub_returns_independent_incidents():
+    env = dk.Environment()
+    first = dk.build_rollup_stub("checkout", env, {"checkout"})
+    first["incidents"][0]["severity"] = "bogus"
+    second = dk.build_rollup_stub("checkout", env, {"checkout"})
+    assert second["incidents"][0]["severity"] == "high"
+
+
+def test_unencodable_output_raises_dkerror():
+    with pytest.raises(DKError, match="Unable to encode output"):
+        dk.encode_output({"segments": [{"id": 2**70}]})
+
+
+def fake_transcription(audio_path, env):
+    text = (REPO_ROOT / "fixtures" / "sample_transcript.txt").read_text(encoding="utf-8")
+    return {"text": text, "language": "en", "confidence": None, "duration_s": None, "segments": []}
+
+
+def test_pipeline_stub(monkeypatch):
+    monkeypatch.setattr(dk, "perform_transcription", fake_transcription)
+    result = run_cli(["pipeline", "--input", "call.mp3", "--mode", "both"])
+    assert result.exit_code == 0, result.stderr
+    payload = json.loads(result.output)
+    validate_schema(payload["metadata"], "metadata")
+    validate_schema(payload["rollup"], "rollup")
+    assert payload["transcription"]["language"] == "en"
+
+
+def test_pipeline_reports_analysis_failure(monkeypatch):
+    real_analysis = dk.perform_analysis
+
+    def fake_analysis(text, mode, env):
+        if mode == "metadata":
+            raise DKError("metadata boom")
+        return real_analysis(text, mode, env)
+
+    monkeypatch.setattr(dk, "perform_transcription", fake_transcription)
+    monkeypatch.setattr(dk, "perform_analysis", fake_analysis)
+    threads_before = threading.active_count()
+    result = run_cli(["pipeline", "--input", "call.mp3", "--mode", "both"])
+    assert result.exit_code != 0
+    assert json.loads(result.stderr) == {"error": "metadata boom", "code": "pipeline_error"}
+    assert threading.active_count() == threads_before
+
+
+def test_missing_schema_errors(tmp_path, monkeypatch):
+    monkeypatch.setitem(dk._SCHEMA_PATHS, "metadata", tmp_path / "missing.schema.json")
+    _get_validator.cache_clear()
+    try:
+        transcript = REPO_ROOT / "fixtures" / "sample_transcript.txt"
+        result = run_cli(["analyze", "--input", str(transcript), "--mode", "metadata"])
+    finally:
+        _get_validator.cache_clear()
+    assert result.exit_code != 0
+    assert json.loads(result.stderr)["error"].startswith("Unable to load schema metadata")
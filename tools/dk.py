@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
+import functools
 import json
 import os
 import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional, Set, Tuple
 
 import click
-import requests
+import orjson
 from jsonschema import Draft7Validator
-from openai import OpenAI
+from jsonschema.exceptions import SchemaError
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 SCHEMAS_DIR = REPO_ROOT / "schemas"
+_SCHEMA_PATHS = {name: SCHEMAS_DIR / f"{name}.schema.json" for name in ("metadata", "rollup")}
 
 ALLOWED_ENVS = {
     "TRANSCRIBE_BACKEND",
@@ -26,9 +30,52 @@ ALLOWED_ENVS = {
     "LOCALAI_TIMEOUT_S",
     "DEFAULT_TIMEZONE",
 }
-
-
-@dataclass
+_ENV_KEYS = tuple(sorted(ALLOWED_ENVS))
+MAX_TRANSCRIPT_BYTES = 8 * 1024 * 1024
+
+_PARTICIPANT_RE = re.compile(r"(Agent|Caller) ([A-Z][a-zA-Z]+)")
+_TIME_RE = re.compile(r"(\d{1,2}:\d{2}\s?[APMapm]{2}\s?[A-Za-z/]*)")
+_FENCE_RE = re.compile(r"```[a-zA-Z]*")
+_DECODER = json.JSONDecoder()
+
+_METADATA_SUMMARY = (
+    "Caller reported checkout API timeouts impacting customers; rollback is stabilizing while monitoring continues."
+)
+_METADATA_ACTION_ITEMS = ("Send summary and next steps", "Monitor checkout stability")
+_ROLLUP_SUMMARY = "Intermittent checkout API failures; rollback underway and monitoring in place."
+_ROLLUP_NEXT_STEPS = (
+    "Confirm rollback completion",
+    "Monitor error rates",
+    "Share customer-facing summary",
+)
+
+# (keyword, output) rules for the stub builders; keywords match case-insensitively
+_ISSUE_RULES = (
+    ("checkout", "Checkout API timeouts"),
+    ("config change", "Recent config change"),
+)
+_INCIDENT_RULES = (
+    (
+        "checkout",
+        {
+            "type": "checkout-api",
+            "description": "Checkout API is timing out for production customers",
+            "severity": "high",
+        },
+    ),
+    (
+        "config change",
+        {
+            "type": "config-change",
+            "description": "Recent payment gateway config change correlated with incident",
+            "severity": "medium",
+        },
+    ),
+)
+_KEYWORDS = tuple(dict(_ISSUE_RULES + _INCIDENT_RULES))
+
+
+@dataclass(frozen=True, slots=True)
 class Environment:
     transcribe_backend: str = "openai"
     analyze_backend: str = "localai"
@@ -48,35 +95,64 @@ class DKError(Exception):
 def emit_error(message: str, code: str = "error") -> None:
     payload = {"error": message, "code": code}
     sys.stderr.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    sys.stderr.flush()
     sys.exit(1)
 
 
 def load_environment() -> Environment:
-    env = Environment()
-    raw_env = {k: os.environ.get(k) for k in ALLOWED_ENVS}
-
-    if raw_env.get("TRANSCRIBE_BACKEND"):
-        env.transcribe_backend = raw_env["TRANSCRIBE_BACKEND"].strip().lower()
-    if raw_env.get("ANALYZE_BACKEND"):
-        env.analyze_backend = raw_env["ANALYZE_BACKEND"].strip().lower()
-    if raw_env.get("OPENAI_API_KEY"):
-        env.openai_api_key = raw_env["OPENAI_API_KEY"]
-    if raw_env.get("OPENAI_STT_MODEL"):
-        env.openai_stt_model = raw_env["OPENAI_STT_MODEL"]
-    if raw_env.get("LOCALAI_STT_MODEL"):
-        env.localai_stt_model = raw_env["LOCALAI_STT_MODEL"]
-    if raw_env.get("LOCALAI_BASE_URL"):
-        env.localai_base_url = raw_env["LOCALAI_BASE_URL"].rstrip("/")
-    if raw_env.get("LOCALAI_MODEL"):
-        env.localai_model = raw_env["LOCALAI_MODEL"]
-    if raw_env.get("LOCALAI_TIMEOUT_S"):
+    snapshot = tuple((key, os.environ.get(key)) for key in _ENV_KEYS)
+    return _build_environment(snapshot)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_environment(snapshot: Tuple[Tuple[str, Optional[str]], ...]) -> Environment:
+    fields: Dict[str, Any] = {}
+    env_get = dict(snapshot).get
+
+    value = env_get("TRANSCRIBE_BACKEND")
+    if value:
+        fields["transcribe_backend"] = value.strip().lower()
+    value = env_get("ANALYZE_BACKEND")
+    if value:
+        fields["analyze_backend"] = value.strip().lower()
+    value = env_get("OPENAI_API_KEY")
+    if value:
+        fields["openai_api_key"] = value
+    value = env_get("OPENAI_STT_MODEL")
+    if value:
+        fields["openai_stt_model"] = value
+    value = env_get("LOCALAI_STT_MODEL")
+    if value:
+        fields["localai_stt_model"] = value
+    value = env_get("LOCALAI_BASE_URL")
+    if value:
+        fields["localai_base_url"] = value.rstrip("/")
+    value = env_get("LOCALAI_MODEL")
+    if value:
+        fields["localai_model"] = value
+    value = env_get("LOCALAI_TIMEOUT_S")
+    if value:
         try:
-            env.localai_timeout = int(raw_env["LOCALAI_TIMEOUT_S"])
+            fields["localai_timeout"] = int(value)
         except ValueError:
             raise DKError("LOCALAI_TIMEOUT_S must be an integer")
-    if raw_env.get("DEFAULT_TIMEZONE"):
-        env.default_timezone = raw_env["DEFAULT_TIMEZONE"]
-    return env
+    value = env_get("DEFAULT_TIMEZONE")
+    if value:
+        fields["default_timezone"] = value
+    return Environment(**fields)
+
+
+def encode_output(payload: Dict[str, Any]) -> bytes:
+    try:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2) + b"\n"
+    except orjson.JSONEncodeError as exc:
+        raise DKError(f"Unable to encode output: {exc}")
+
+
+def write_stdout(data: bytes) -> None:
+    sys.stdout.flush()
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
 
 
 def ensure_file_exists(path: Path) -> None:
@@ -84,23 +160,47 @@ def ensure_file_exists(path: Path) -> None:
         raise DKError(f"Input file not found: {path}")
 
 
+def read_transcript(path: Path) -> str:
+    ensure_file_exists(path)
+    with path.open("rb") as f:
+        data = f.read(MAX_TRANSCRIPT_BYTES + 1)
+    if len(data) > MAX_TRANSCRIPT_BYTES:
+        raise DKError(f"Transcript exceeds {MAX_TRANSCRIPT_BYTES} bytes: {path}")
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        raise DKError(f"Transcript is not valid UTF-8: {exc}")
+
+
 def load_schema(path: Path) -> Dict[str, Any]:
     with path.open("r", encoding="utf-8") as f:
         return json.load(f)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_validator(schema_name: str) -> Draft7Validator:
+    try:
+        schema_path = _SCHEMA_PATHS[schema_name]
+    except KeyError:
+        raise DKError(f"Unknown schema: {schema_name}")
+    try:
+        schema = load_schema(schema_path)
+        Draft7Validator.check_schema(schema)
+    except (OSError, json.JSONDecodeError, SchemaError) as exc:
+        raise DKError(f"Unable to load schema {schema_name}: {exc}")
+    return Draft7Validator(schema, format_checker=None)
+
+
 def validate_payload(payload: Dict[str, Any], schema_name: str) -> None:
-    schema_path = SCHEMAS_DIR / f"{schema_name}.schema.json"
-    schema = load_schema(schema_path)
-    validator = Draft7Validator(schema)
-    errors = sorted(validator.iter_errors(payload), key=lambda e: e.path)
-    if errors:
-        message = errors[0].message
-        raise DKError(f"Schema validation failed for {schema_name}: {message}")
+    error = next(_get_validator(schema_name).iter_errors(payload), None)
+    if error is not None:
+        raise DKError(f"Schema validation failed for {schema_name}: {error.message}")
 
 
 def strip_code_fences(text: str) -> str:
-    fenced = re.sub(r"```[a-zA-Z]*", "", text)
+    if "```" not in text:
+        return text.strip()
+    fenced = _FENCE_RE.sub("", text)
     return fenced.replace("```", "").strip()
 
 
@@ -110,28 +210,37 @@ def extract_first_json(text: str) -> Dict[str, Any]:
     if start == -1:
         raise DKError("No JSON object found in model response")
 
-    depth = 0
-    collected: List[str] = []
-    for char in clean[start:]:
-        if char == "{":
-            depth += 1
-        if char == "}":
-            depth -= 1
-        collected.append(char)
-        if depth == 0:
-            break
-
-    candidate = "".join(collected)
     try:
-        return json.loads(candidate)
+        obj, _end = _DECODER.raw_decode(clean, start)
     except json.JSONDecodeError as exc:
         raise DKError(f"Unable to parse JSON object: {exc}")
+    return obj
+
+
+_THREAD_STATE = threading.local()
+
+
+def _http_session() -> Any:
+    """Per-thread keep-alive session for LocalAI calls; requests is imported on first use."""
+    session = getattr(_THREAD_STATE, "session", None)
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _THREAD_STATE.session = session
+    return session
 
 
 def transcribe_openai(audio_path: Path, env: Environment) -> Dict[str, Any]:
     if not env.openai_api_key:
         raise DKError("OPENAI_API_KEY is required for OpenAI transcription")
 
+    from openai import OpenAI
+
     client = OpenAI(api_key=env.openai_api_key)
     with audio_path.open("rb") as file_data:
         response = client.audio.transcriptions.create(
@@ -154,7 +263,7 @@ def transcribe_localai(audio_path: Path, env: Environment) -> Dict[str, Any]:
     with audio_path.open("rb") as f:
         files = {"file": f}
         data = {"model": env.localai_stt_model}
-        resp = requests.post(url, files=files, data=data, timeout=env.localai_timeout)
+        resp = _http_session().post(url, files=files, data=data, timeout=env.localai_timeout)
     if resp.status_code >= 400:
         raise DKError(f"LocalAI transcription failed: {resp.text}")
     payload = resp.json()
@@ -191,72 +300,41 @@ def validate_transcription_payload(payload: Dict[str, Any]) -> None:
         raise DKError("segments must be an array")
 
 
-def build_metadata_stub(text: str, env: Environment) -> Dict[str, Any]:
+def _scan_keywords(text: str) -> Set[str]:
+    """Return the stub keywords present in text, matched case-insensitively."""
+    lower = text.lower()
+    return {keyword for keyword in _KEYWORDS if keyword in lower}
+
+
+def build_metadata_stub(text: str, env: Environment, keywords: Set[str]) -> Dict[str, Any]:
     participants = []
-    for marker in ["Agent", "Caller"]:
-        pattern = rf"{marker} ([A-Z][a-zA-Z]+)"
-        matches = re.findall(pattern, text)
-        for match in matches:
-            name = match.strip()
-            if name not in participants:
-                participants.append(name)
-
-    time_match = re.search(r"(\d{1,2}:\d{2}\s?[APMapm]{2}\s?[A-Za-z/]*)", text)
-    call_time = time_match.group(1).strip() if time_match else None
+    for _role, name in _PARTICIPANT_RE.findall(text):
+        if name not in participants:
+            participants.append(name)
 
-    issues = []
-    if "checkout" in text.lower():
-        issues.append("Checkout API timeouts")
-    if "config change" in text.lower():
-        issues.append("Recent config change")
+    time_match = _TIME_RE.search(text)
+    call_time = time_match.group(1).strip() if time_match else None
 
-    action_items = ["Send summary and next steps", "Monitor checkout stability"]
-    summary = (
-        "Caller reported checkout API timeouts impacting customers; rollback is stabilizing while monitoring continues."
-    )
-    sentiment = "neutral"
+    issues = [issue for keyword, issue in _ISSUE_RULES if keyword in keywords]
 
     return {
-        "summary": summary,
+        "summary": _METADATA_SUMMARY,
         "participants": participants,
-        "sentiment": sentiment,
+        "sentiment": "neutral",
         "call_datetime": call_time,
         "timezone": env.default_timezone,
-        "action_items": action_items,
+        "action_items": list(_METADATA_ACTION_ITEMS),
         "issues": issues,
     }
 
 
-def build_rollup_stub(text: str, env: Environment) -> Dict[str, Any]:
-    incidents = []
-    if "checkout" in text.lower():
-        incidents.append(
-            {
-                "type": "checkout-api",
-                "description": "Checkout API is timing out for production customers",
-                "severity": "high",
-            }
-        )
-    if "config change" in text.lower():
-        incidents.append(
-            {
-                "type": "config-change",
-                "description": "Recent payment gateway config change correlated with incident",
-                "severity": "medium",
-            }
-        )
-    summary = "Intermittent checkout API failures; rollback underway and monitoring in place."
-    next_steps = [
-        "Confirm rollback completion",
-        "Monitor error rates",
-        "Share customer-facing summary",
-    ]
-    status = "monitoring"
+def build_rollup_stub(text: str, env: Environment, keywords: Set[str]) -> Dict[str, Any]:
+    incidents = [dict(incident) for keyword, incident in _INCIDENT_RULES if keyword in keywords]
     return {
-        "summary": summary,
+        "summary": _ROLLUP_SUMMARY,
         "incidents": incidents,
-        "next_steps": next_steps,
-        "status": status,
+        "next_steps": list(_ROLLUP_NEXT_STEPS),
+        "status": "monitoring",
     }
 
 
@@ -271,7 +349,7 @@ def call_localai_chat(prompt: str, text: str, env: Environment) -> Dict[str, Any
         "messages": messages,
         "temperature": 0,
     }
-    resp = requests.post(url, json=body, timeout=env.localai_timeout)
+    resp = _http_session().post(url, json=body, timeout=env.localai_timeout)
     if resp.status_code >= 400:
         raise DKError(f"LocalAI analysis failed: {resp.text}")
     payload = resp.json()
@@ -288,11 +366,12 @@ def perform_analysis(text: str, mode: str, env: Environment) -> Dict[str, Any]:
         raise DKError(f"Unsupported analysis mode: {mode}")
 
     if env.analyze_backend == "stub":
+        keywords = _scan_keywords(text)
         if mode == "metadata":
-            result = build_metadata_stub(text, env)
+            result = build_metadata_stub(text, env, keywords)
             validate_payload(result, "metadata")
             return result
-        result = build_rollup_stub(text, env)
+        result = build_rollup_stub(text, env, keywords)
         validate_payload(result, "rollup")
         return result
 
@@ -324,11 +403,11 @@ def transcribe(input_path: Path, output_path: Optional[Path]) -> None:
     try:
         env = load_environment()
         result = perform_transcription(input_path, env)
-        output = json.dumps(result, ensure_ascii=False, indent=2)
+        output = encode_output(result)
         if output_path:
-            output_path.write_text(output + "\n", encoding="utf-8")
+            output_path.write_bytes(output)
         else:
-            sys.stdout.write(output + "\n")
+            write_stdout(output)
     except DKError as exc:
         emit_error(str(exc), code="transcribe_error")
 
@@ -340,11 +419,9 @@ def analyze(input_path: Path, mode: str) -> None:
     """Analyze transcript text into structured JSON."""
     try:
         env = load_environment()
-        ensure_file_exists(input_path)
-        text = input_path.read_text(encoding="utf-8")
+        text = read_transcript(input_path)
         result = perform_analysis(text, mode, env)
-        output = json.dumps(result, ensure_ascii=False, indent=2)
-        sys.stdout.write(output + "\n")
+        write_stdout(encode_output(result))
     except DKError as exc:
         emit_error(str(exc), code="analysis_error")
 
@@ -358,15 +435,21 @@ def pipeline(input_path: Path, mode: str) -> None:
         env = load_environment()
         transcription = perform_transcription(input_path, env)
         text = transcription.get("text", "")
-        metadata = perform_analysis(text, "metadata", env)
-        rollup = perform_analysis(text, "rollup", env)
+        # build both validators up front so the workers don't each compile one
+        _get_validator("metadata")
+        _get_validator("rollup")
+        # the two analyses are independent; overlap their LocalAI round-trips
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            metadata_future = executor.submit(perform_analysis, text, "metadata", env)
+            rollup_future = executor.submit(perform_analysis, text, "rollup", env)
+            metadata = metadata_future.result()
+            rollup = rollup_future.result()
         payload = {
             "transcription": transcription,
             "metadata": metadata,
             "rollup": rollup,
         }
-        output = json.dumps(payload, ensure_ascii=False, indent=2)
-        sys.stdout.write(output + "\n")
+        write_stdout(encode_output(payload))
     except DKError as exc:
         emit_error(str(exc), code="pipeline_error")
 